@@ -1,10 +1,23 @@
+import asyncio
+import copy
 import logging
 import azure.functions as func
 import chess
 import chess.engine
+import chess.polyglot
 import os
-import json
+import math
+import orjson
+import re
 import time
+from collections import OrderedDict
+
+app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+
+# Module logger with %-style deferred formatting: arguments are only rendered
+# into the message when a handler actually emits the record, so filtered log
+# levels cost a level check instead of per-request string formatting.
+_log = logging.getLogger(__name__)
 
 # --- Configuration ---
 # Adjust this path based on where you place the Stockfish executable relative to this script
@@ -13,11 +26,161 @@ STOCKFISH_PATH = os.path.join(os.path.dirname(__file__), 'bin', 'stockfish')
 # If you are on Windows for local testing (ensure your Azure Function OS matches for deployment)
 # STOCKFISH_PATH = os.path.join(os.path.dirname(__file__), 'bin', 'stockfish.exe')
 
+# Win-chance scaling: 1 / (1 + 10**(-k*cp)) with k = 0.004, folded into a
+# single exp() call via 10**x == exp(x * ln 10).
+_WIN_CHANCE_K = 0.004 * math.log(10)
+
+# Square lookup tables: indexing a tuple beats a function call (plus string
+# formatting) per square, and from/to are rendered on every response.
+_SQ_NAMES = tuple(chess.square_name(sq) for sq in range(64))
+_SQ_NUMERIC = tuple(str(sq) for sq in range(64))
+
+# Response skeleton, copied per request. dict.copy() of a prebuilt dict is a
+# single C-level operation, versus rebuilding a 25-key literal every call;
+# only the fields that actually get values are then assigned.
+_RESULT_TEMPLATE = {
+    "fen": None,
+    "depth": None,
+    "seldepth": None, # Selective depth
+    "nodes": None,
+    "nps": None, # Nodes per second
+    "time": None, # milliseconds
+    "mate": None,
+    "eval": None,
+    "centipawns": None,
+    "text": "",
+    "move": None,
+    "san": None,
+    "lan": None,
+    "turn": None,
+    "color": None, # Assuming 'color' means current turn's color
+    "piece": None,
+    "flags": None,
+    "isCapture": None,
+    "isCastling": None,
+    "isPromotion": None,
+    "from": None,
+    "to": None,
+    "fromNumeric": None,
+    "toNumeric": None,
+    "continuationArr": (),
+    "winChance": None # Calculating this accurately requires a specific formula
+}
+
+# Caps on client-supplied search limits. An unbounded depth (or time) pins a
+# vCPU for minutes and blocks every other request on this instance, since the
+# engine is shared. SF_MAX_DEPTH lets deployments raise the ceiling.
+_MAX_DEPTH = int(os.environ.get("SF_MAX_DEPTH", "20"))
+_MAX_TIME_SEC = 10.0
+
+
+def _parse_depth(value, default: int = 12) -> int:
+    """Parses a client-supplied depth, clamping it to [1, _MAX_DEPTH]."""
+    try:
+        depth = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(_MAX_DEPTH, depth))
+
+
+def _parse_time_limit(value, default: float = 5.0) -> float:
+    """Parses a client-supplied time limit in seconds, capped at _MAX_TIME_SEC."""
+    try:
+        time_limit = float(value)
+    except (TypeError, ValueError):
+        return default
+    return max(0.1, min(_MAX_TIME_SEC, time_limit))
 
-async def get_stockfish_analysis(fen_string: str, depth_limit: int = 12, time_limit_sec: float = 5.0):
+
+# Cheap shape check for FENs, applied before constructing a Board. Rejecting
+# malformed input here costs microseconds instead of a full bitboard build;
+# chess.Board remains the authority on whether the position is legal. The
+# move counters are optional because python-chess accepts FENs without them.
+_FEN_RE = re.compile(r'^[rnbqkpRNBQKP1-8/]+ [wb] (?:-|[KQkqA-Ha-h]+) (?:-|[a-h][1-8])(?: \d+ \d+)?$')
+
+
+def _dumps(obj) -> bytes:
+    """Serializes a response dict to JSON bytes with orjson.
+
+    orjson rejects non-finite floats, so the infinite `eval` used for mate
+    scores is replaced with a "mate"/"-mate" string before serializing.
+    """
+    ev = obj.get("eval")
+    if isinstance(ev, float) and math.isinf(ev):
+        obj = dict(obj)
+        obj["eval"] = "mate" if ev > 0 else "-mate"
+    return orjson.dumps(obj)
+
+# --- Persistent engine ---
+# Spawning Stockfish (fork+exec plus the UCI handshake) costs far more than a
+# short search, so a single engine is spawned lazily on the first invocation and
+# reused for every warm invocation of this Function instance. Access is
+# serialized with a lock; UCI engines analyze one position at a time anyway.
+#
+# When SF_SOCKET_PATH is set, the engine is not spawned in this worker at all:
+# the UCI session runs over a Unix socket served by a pre-warmed Stockfish
+# sidecar, so new worker instances only pay the UCI handshake, not fork+exec.
+_ENGINE_LOCK = asyncio.Lock()
+_ENGINE = None
+SF_SOCKET_PATH = os.environ.get("SF_SOCKET_PATH")
+
+
+class _UciSocketBridge(asyncio.Protocol):
+    """Connects chess.engine's subprocess-oriented protocol to a socket.
+
+    chess.engine.Protocol expects a subprocess transport (stdin via
+    get_pipe_transport(0), stdout via pipe_data_received). This adapter sits
+    on the socket transport and presents that surface, so the stock
+    UciProtocol works unchanged against a sidecar engine.
     """
-    Analyzes a FEN position using Stockfish.
+
+    def __init__(self, uci_protocol: chess.engine.UciProtocol):
+        self._uci = uci_protocol
+        self._transport = None
+        self._returncode = None
+
+    # asyncio.Protocol callbacks (socket side).
+    def connection_made(self, transport):
+        self._transport = transport
+        self._uci.connection_made(self)
+
+    def data_received(self, data):
+        self._uci.pipe_data_received(1, data)
+
+    def connection_lost(self, exc):
+        # Protocol.connection_lost requires a returncode; the sidecar's exit
+        # status is unknowable from here, so report a clean close.
+        self._returncode = 0
+        self._uci.connection_lost(exc)
+
+    # Subprocess-transport surface used by chess.engine.Protocol.
+    def get_pipe_transport(self, fd):
+        return self._transport if fd == 0 else None
+
+    def get_returncode(self):
+        return self._returncode
+
+    def get_pid(self):
+        return -1  # no local process; only used in protocol repr
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+_STOCKFISH_CHECKED = False
+
+
+def _ensure_stockfish_binary():
+    """Verifies the bundled binary exists and is executable, once.
+
+    The binary and its permissions are immutable after deploy, so the
+    stat/access syscalls (and the chmod fallback) run only before the first
+    spawn instead of on every request.
     """
+    global _STOCKFISH_CHECKED
+    if _STOCKFISH_CHECKED:
+        return
     if not os.path.exists(STOCKFISH_PATH):
         raise FileNotFoundError(f"Stockfish executable not found at {STOCKFISH_PATH}")
     if not os.access(STOCKFISH_PATH, os.X_OK):
@@ -25,86 +188,236 @@ async def get_stockfish_analysis(fen_string: str, depth_limit: int = 12, time_li
         # It's best to ensure execute permissions are set before deployment.
         try:
             os.chmod(STOCKFISH_PATH, 0o755) # rwxr-xr-x
-            logging.warning(f"Attempted to set execute permission for {STOCKFISH_PATH}")
+            _log.warning("Attempted to set execute permission for %s", STOCKFISH_PATH)
             if not os.access(STOCKFISH_PATH, os.X_OK):
                  raise PermissionError(f"Stockfish executable at {STOCKFISH_PATH} is not executable after chmod.")
         except Exception as e:
             raise PermissionError(f"Stockfish executable at {STOCKFISH_PATH} is not executable. Error: {e}")
+    _STOCKFISH_CHECKED = True
+
+
+async def _spawn_engine() -> chess.engine.UciProtocol:
+    """Starts a UCI session: sidecar socket if configured, else subprocess."""
+    if SF_SOCKET_PATH:
+        engine = chess.engine.UciProtocol()
+        loop = asyncio.get_running_loop()
+        await loop.create_unix_connection(lambda: _UciSocketBridge(engine), path=SF_SOCKET_PATH)
+        await engine.initialize()
+        return engine
+    _ensure_stockfish_binary()
+    _, engine = await chess.engine.popen_uci(STOCKFISH_PATH)
+    return engine
+
+# --- Analysis cache ---
+# Transposition-table-style cache of finished analyses, keyed by the Zobrist
+# hash of the position. Hashing the 64-bit int is effectively free per probe,
+# unlike hashing a ~70-byte FEN string, and the key is computed once per
+# request from the already-built bitboards. Repeated requests for the same
+# position (common for opening FENs) skip Stockfish entirely. An entry
+# analyzed to depth d can serve any request for depth <= d, just like a chess
+# TT; the FEN lives only inside the cached value, for the response echo.
+_CACHE_LOCK = asyncio.Lock()
+_CACHE = OrderedDict()  # zobrist_hash -> (depth, monotonic_timestamp, result)
+_CACHE_MAX_ENTRIES = 4096
+_CACHE_TTL_SEC = 600.0
+
+
+async def _cache_probe(key: int, depth_limit: int):
+    """Returns a cached analysis for `key` at depth >= depth_limit, or None."""
+    async with _CACHE_LOCK:
+        entry = _CACHE.get(key)
+        if entry is None:
+            return None
+        cached_depth, stamp, result = entry
+        if cached_depth < depth_limit or time.monotonic() - stamp > _CACHE_TTL_SEC:
+            return None
+        _CACHE.move_to_end(key)
+    # Deep copy so callers can't mutate the cached entry; report zero compute
+    # time since no search ran.
+    result = copy.deepcopy(result)
+    result["time"] = 0
+    return result
+
+
+async def _cache_store(key: int, depth_limit: int, result: dict):
+    """Stores an analysis result, evicting the least recently used entry."""
+    async with _CACHE_LOCK:
+        existing = _CACHE.get(key)
+        if existing is not None and existing[0] > depth_limit:
+            return  # keep the deeper analysis
+        _CACHE[key] = (depth_limit, time.monotonic(), copy.deepcopy(result))
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > _CACHE_MAX_ENTRIES:
+            _CACHE.popitem(last=False)
+
+
+async def _get_engine():
+    """
+    Returns the shared Stockfish engine, spawning it on first use.
 
-
-    transport, engine = await chess.engine.popen_uci(STOCKFISH_PATH)
-    board = chess.Board(fen_string)
+    Must be called while holding _ENGINE_LOCK. If the previous engine process
+    died, it is discarded and a fresh one is spawned.
+    """
+    global _ENGINE
+    if _ENGINE is not None and _ENGINE.returncode.done():
+        _log.warning("Stockfish engine process died; respawning.")
+        _ENGINE = None
+    elif _ENGINE is not None and SF_SOCKET_PATH:
+        # A half-dead socket doesn't always surface as a lost connection;
+        # verify the sidecar answers before reusing the session.
+        try:
+            await _ENGINE.ping()
+        except chess.engine.EngineError:
+            _log.warning("Stockfish sidecar unresponsive; reconnecting.")
+            _ENGINE.transport.close()
+            _ENGINE = None
+    if _ENGINE is None:
+        engine = await _spawn_engine()
+        # Configure once at spawn time; settings persist for the engine's
+        # life, so Stockfish's own hash table stays warm across requests
+        # instead of being reallocated. SF_THREADS / SF_HASH_MB let
+        # deployments size these to the Azure plan's vCPUs and memory.
+        threads = int(os.environ.get("SF_THREADS", "0")) or max(1, os.cpu_count() or 1)
+        hash_mb = int(os.environ.get("SF_HASH_MB", "128"))
+        await engine.configure({"Threads": threads, "Hash": hash_mb})
+        _ENGINE = engine
+    return _ENGINE
+
+
+def _terminal_result(board: chess.Board, fen_string: str):
+    """Synthesizes a result for game-over positions, or returns None.
+
+    Checkmate, stalemate, insufficient material, and claimable draws are
+    decided by python-chess in microseconds; asking Stockfish to search them
+    would pay the full engine roundtrip for a position with no moves to find.
+    """
+    turn_str = "w" if board.turn == chess.WHITE else "b"
+    if board.is_checkmate():
+        result = _RESULT_TEMPLATE.copy()
+        result["fen"] = fen_string
+        result["depth"] = 0
+        result["time"] = 0
+        result["turn"] = turn_str
+        result["color"] = turn_str
+        result["continuationArr"] = []
+        result["mate"] = 0
+        # The side to move is mated; eval and winChance follow the same
+        # relative/white-perspective conventions as the engine path.
+        result["eval"] = float('-inf')
+        result["centipawns"] = "mate 0"
+        result["winChance"] = 0.0 if board.turn == chess.WHITE else 1.0
+        result["text"] = "Checkmate."
+        return result
+    if board.is_stalemate() or board.is_insufficient_material() or board.can_claim_draw():
+        result = _RESULT_TEMPLATE.copy()
+        result["fen"] = fen_string
+        result["depth"] = 0
+        result["time"] = 0
+        result["turn"] = turn_str
+        result["color"] = turn_str
+        result["continuationArr"] = []
+        result["eval"] = 0.0
+        result["centipawns"] = "0"
+        result["winChance"] = 0.5
+        result["text"] = "Draw."
+        return result
+    return None
+
+
+async def get_stockfish_analysis(board: chess.Board, fen_string: str, depth_limit: int = 12, time_limit_sec: float = 5.0, brief: bool = False):
+    """
+    Analyzes a position using Stockfish. `board` is the already-parsed
+    position; `fen_string` is echoed back in the result. With `brief`, the
+    PV is not rendered into `continuationArr` (only the best move is kept).
+    """
+    terminal = _terminal_result(board, fen_string)
+    if terminal is not None:
+        return terminal
+
+    cache_key = chess.polyglot.zobrist_hash(board)
+    cached = await _cache_probe(cache_key, depth_limit)
+    if cached is not None:
+        # Zobrist keys ignore the move counters, so echo this request's FEN
+        # rather than the one that originally populated the entry.
+        cached["fen"] = fen_string
+        if brief:
+            cached["continuationArr"] = []
+        return cached
 
     analysis_result = {}
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
-        # Configure Stockfish (optional, but good practice)
-        # await engine.configure({"Threads": 1}) # Adjust based on your Azure Function plan
-        # await engine.configure({"Hash": 32})   # Adjust memory
-
-        info = await engine.analyse(board, chess.engine.Limit(depth=depth_limit, time=time_limit_sec))
-        end_time = time.time()
-
-        best_move = info.get("pv", [None])[0] # Principal variation's first move
+        async with _ENGINE_LOCK:
+            engine = await _get_engine()
+            # Fresh game context per request so the engine's internal state
+            # from the previous position doesn't bleed into this search.
+            engine.send_line("ucinewgame")
+            # Stream info lines instead of blocking in analyse() so the
+            # search can be cut short once it has enough: a short forced
+            # mate is final, and depth/time stay the hard caps.
+            info = {}
+            analysis = await engine.analysis(board, chess.engine.Limit(depth=depth_limit, time=time_limit_sec))
+            try:
+                async for line in analysis:
+                    info.update(line)
+                    line_score = line.get("score")
+                    if line_score and line_score.is_mate() and abs(line_score.relative.mate()) <= 3:
+                        break
+                    if info.get("depth", 0) >= depth_limit:
+                        break
+            finally:
+                analysis.stop()
+        elapsed_ms = int((time.perf_counter() - start_time) * 1000)
+
+        # Hoist the repeatedly-used info/board/score lookups into locals;
+        # everything below reads these instead of re-querying.
+        turn_w = board.turn == chess.WHITE
+        turn_str = "w" if turn_w else "b"
+        depth_out = info.get("depth")
+        pv = info.get("pv", [])
+        best_move = pv[0] if pv else None # Principal variation's first move
         score = info.get("score")
-
-        analysis_result = {
-            "fen": fen_string,
-            "depth": info.get("depth"),
-            "seldepth": info.get("seldepth"), # Selective depth
-            "nodes": info.get("nodes"),
-            "nps": info.get("nps"), # Nodes per second
-            "time": int((end_time - start_time) * 1000), # milliseconds
-            "mate": None,
-            "eval": None,
-            "centipawns": None,
-            "text": "",
-            "move": None,
-            "san": None,
-            "lan": None,
-            "turn": "w" if board.turn == chess.WHITE else "b",
-            "color": "w" if board.turn == chess.WHITE else "b", # Assuming 'color' means current turn's color
-            "piece": None,
-            "flags": None,
-            "isCapture": None,
-            "isCastling": None,
-            "isPromotion": None,
-            "from": None,
-            "to": None,
-            "fromNumeric": None,
-            "toNumeric": None,
-            "continuationArr": [move.uci() for move in info.get("pv", [])],
-            "winChance": None # Calculating this accurately requires a specific formula
-        }
-
+        is_mate = score.is_mate() if score else False
+
+        analysis_result = _RESULT_TEMPLATE.copy()
+        analysis_result["fen"] = fen_string
+        analysis_result["depth"] = depth_out
+        analysis_result["seldepth"] = info.get("seldepth")
+        analysis_result["nodes"] = info.get("nodes")
+        analysis_result["nps"] = info.get("nps")
+        analysis_result["time"] = elapsed_ms # milliseconds
+        analysis_result["turn"] = turn_str
+        analysis_result["color"] = turn_str
+        # Render the PV to UCI once; move/lan reuse the first entry below.
+        uci_pv = [best_move.uci()] if brief and best_move else [move.uci() for move in pv]
+        analysis_result["continuationArr"] = [] if brief else uci_pv
+
+        mate_val = None
         if score:
-            if score.is_mate():
-                analysis_result["mate"] = score.mate()
-                analysis_result["eval"] = float('inf') if score.mate() > 0 else float('-inf')
-                analysis_result["centipawns"] = "mate " + str(score.mate())
-                analysis_result["text"] = f"Mate in {abs(score.mate())}. Depth {info.get('depth')}."
+            if is_mate:
+                mate_val = score.relative.mate() # Moves to mate, relative to current player
+                analysis_result["mate"] = mate_val
+                analysis_result["eval"] = float('inf') if mate_val > 0 else float('-inf')
+                analysis_result["centipawns"] = "mate " + str(mate_val)
             else:
                 cp = score.relative.score(mate_score=10000) # Centipawns relative to current player
                 analysis_result["eval"] = cp / 100.0
                 analysis_result["centipawns"] = str(cp)
                 winning_status = "winning" if cp > 50 else "losing" if cp < -50 else "equal"
-                player_turn = "White" if board.turn == chess.WHITE else "Black"
-                if cp < 0 and board.turn == chess.WHITE : winning_status = "losing"
-                if cp > 0 and board.turn == chess.BLACK : winning_status = "losing"
-
-
-                analysis_result["text"] = f"Eval: {cp/100.0:.2f}. {player_turn} is {winning_status}. Depth {info.get('depth')}."
+                player_turn = "White" if turn_w else "Black"
+                if cp < 0 and turn_w : winning_status = "losing"
+                if cp > 0 and not turn_w : winning_status = "losing"
 
 
         if best_move:
-            analysis_result["move"] = best_move.uci()
-            analysis_result["lan"] = best_move.uci()
+            analysis_result["move"] = uci_pv[0]
+            analysis_result["lan"] = uci_pv[0]
             analysis_result["san"] = board.san(best_move)
-            analysis_result["from"] = chess.square_name(best_move.from_square)
-            analysis_result["to"] = chess.square_name(best_move.to_square)
-            analysis_result["fromNumeric"] = str(best_move.from_square) # numeric representation (0-63)
-            analysis_result["toNumeric"] = str(best_move.to_square)   # numeric representation (0-63)
+            analysis_result["from"] = _SQ_NAMES[best_move.from_square]
+            analysis_result["to"] = _SQ_NAMES[best_move.to_square]
+            analysis_result["fromNumeric"] = _SQ_NUMERIC[best_move.from_square] # numeric representation (0-63)
+            analysis_result["toNumeric"] = _SQ_NUMERIC[best_move.to_square]   # numeric representation (0-63)
 
             moved_piece = board.piece_at(best_move.from_square)
             if moved_piece:
@@ -115,66 +428,87 @@ async def get_stockfish_analysis(fen_string: str, depth_limit: int = 12, time_li
             analysis_result["isPromotion"] = best_move.promotion is not None
             analysis_result["flags"] = get_move_flags(board, best_move)
 
-            # Update text with best move
-            if analysis_result["san"]:
-                 analysis_result["text"] = f"Best move {analysis_result['san']}: [{analysis_result.get('eval', 'N/A')}]. {analysis_result['text'].split('. ', 1)[-1]}"
+        # Build text once from the components computed above, instead of
+        # formatting a provisional string and re-splitting it per branch.
+        san_str = analysis_result["san"]
+        if san_str:
+            if mate_val is not None:
+                analysis_result["text"] = f"Best move {san_str}: mate in {abs(mate_val)}. Depth {depth_out}."
+            elif score:
+                analysis_result["text"] = (f"Best move {san_str}: [{cp/100.0:.2f}]. "
+                                           f"{player_turn} is {winning_status}. Depth {depth_out}.")
+        elif mate_val is not None:
+            analysis_result["text"] = f"Mate in {abs(mate_val)}. Depth {depth_out}."
+        elif score:
+            analysis_result["text"] = f"Eval: {cp/100.0:.2f}. {player_turn} is {winning_status}. Depth {depth_out}."
 
 
         # Basic win chance calculation (example, can be more sophisticated)
-        # Using a simple sigmoid-like function for centipawns
-        if analysis_result["eval"] is not None and not score.is_mate():
-            # K is a scaling factor, you might need to adjust it
-            # This formula is just an example, not a standard.
-            k_factor = 0.004
-            win_chance_current_player = 1 / (1 + 10**(-k_factor * analysis_result["centipawns"]))
-            analysis_result["winChance"] = win_chance_current_player if board.turn == chess.WHITE else 1 - win_chance_current_player
+        # Using a simple sigmoid-like function for centipawns. Uses the raw
+        # centipawn int, never the stringified "centipawns" field.
+        if analysis_result["eval"] is not None and not is_mate:
+            win_chance_current_player = 1.0 / (1.0 + math.exp(-_WIN_CHANCE_K * cp))
+            analysis_result["winChance"] = win_chance_current_player if turn_w else 1.0 - win_chance_current_player
 
 
     except chess.engine.EngineTerminatedError as e:
-        logging.error(f"Stockfish engine terminated: {e}")
+        _log.error("Stockfish engine terminated: %s", e)
+        # Drop the dead engine so the next request spawns a fresh one.
+        global _ENGINE
+        _ENGINE = None
         raise
     except Exception as e:
-        logging.error(f"Error during Stockfish analysis: {e}")
+        _log.error("Error during Stockfish analysis: %s", e)
         raise
-    finally:
-        await engine.quit()
 
+    if not brief:
+        # Brief results lack the PV; caching them would serve truncated
+        # entries to full requests for the same position.
+        await _cache_store(cache_key, depth_limit, analysis_result)
     return analysis_result
 
 def get_move_flags(board, move):
     """Generates move flags similar to chess.js (n,b,e,c,p,k,q)."""
-    flags = ""
-    if move.promotion:
-        flags += "p" # Promotion
-    elif board.is_kingside_castling(move):
-        flags += "k" # Kingside castling
-    elif board.is_queenside_castling(move):
-        flags += "q" # Queenside castling
-
-    if board.is_capture(move):
-        if board.is_en_passant(move):
-            flags += "e" # En passant
-        else:
-            flags += "c" # Capture
-    
-    if not flags and not board.is_capture(move) and not move.promotion: # Normal move
-        flags = "n"
-    # 'b' for pawn push by 2 squares - python-chess doesn't directly flag this in move object,
-    # but you can infer it if piece is pawn and it moves two squares.
+    # Query the board once per fact; each python-chess predicate re-reads
+    # bitboards, so the cheap flags are derived from locals instead.
     piece = board.piece_at(move.from_square)
-    if piece and piece.piece_type == chess.PAWN:
-        if abs(move.to_square // 8 - move.from_square // 8) == 2:
-            flags = "b" + flags.replace("n","") # Big pawn push
-
-    return flags
+    is_capture = board.is_capture(move)
+    is_en_passant = is_capture and board.is_en_passant(move)
+    is_promotion = move.promotion is not None
+    is_castling = board.is_castling(move)
+    is_kingside = is_castling and board.is_kingside_castling(move)
+    # 'b' for a pawn push by 2 squares - python-chess doesn't directly flag
+    # this in the move object, but a pawn moving two ranks implies it.
+    is_big_push = (piece is not None and piece.piece_type == chess.PAWN
+                   and abs((move.to_square >> 3) - (move.from_square >> 3)) == 2)
+
+    parts = []
+    if is_promotion:
+        parts.append("p") # Promotion
+    elif is_kingside:
+        parts.append("k") # Kingside castling
+    elif is_castling:
+        parts.append("q") # Queenside castling
+
+    if is_en_passant:
+        parts.append("e") # En passant
+    elif is_capture:
+        parts.append("c") # Capture
+
+    if is_big_push:
+        parts.insert(0, "b") # Big pawn push
+
+    return "".join(parts) or "n"
 
 @app.function_name(name="HttpTrigger1")
 @app.route(route="eval")
-def main(req: func.HttpRequest) -> func.HttpResponse:
-    logging.info('Python HTTP trigger function processed a stockfish_eval request.')
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    if _log.isEnabledFor(logging.INFO):
+        _log.info('Python HTTP trigger function processed a stockfish_eval request.')
 
     fen = None
     depth = 12 # Default depth
+    time_limit = 5.0
     req_body = {}
 
     try:
@@ -183,53 +517,65 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         pass # Handle cases where body isn't JSON or is empty
     else:
         fen = req_body.get('fen')
-        depth = int(req_body.get('depth', 12)) # Allow overriding depth
+        depth = _parse_depth(req_body.get('depth')) # Allow overriding depth, clamped
+        time_limit = _parse_time_limit(req_body.get('time'))
 
     if not fen:
         fen = req.params.get('fen')
         if req.params.get('depth'):
-            depth = int(req.params.get('depth'))
+            depth = _parse_depth(req.params.get('depth'))
+        if req.params.get('time'):
+            time_limit = _parse_time_limit(req.params.get('time'))
+
+    brief = req.params.get('brief') == '1' or bool(req_body.get('brief'))
 
 
     if fen:
         try:
-            # Basic FEN validation
+            # Basic FEN validation: regex shape check first so obviously
+            # malformed input is rejected without building a Board.
+            if not _FEN_RE.match(fen):
+                return func.HttpResponse(
+                    _dumps({"error": "Invalid FEN string provided."}),
+                    status_code=400,
+                    mimetype="application/json"
+                )
             try:
                 board_test = chess.Board(fen)
             except ValueError:
                 return func.HttpResponse(
-                    json.dumps({"error": "Invalid FEN string provided."}),
+                    _dumps({"error": "Invalid FEN string provided."}),
                     status_code=400,
                     mimetype="application/json"
                 )
 
             # Call the analysis function
-            analysis_results = await get_stockfish_analysis(fen, depth_limit=depth)
+            analysis_results = await get_stockfish_analysis(board_test, fen, depth_limit=depth, time_limit_sec=time_limit, brief=brief)
             analysis_results["taskId"] = req.headers.get("X-Request-ID", "defaultTaskId") # Example for taskId
 
             return func.HttpResponse(
-                json.dumps(analysis_results),
+                _dumps(analysis_results),
                 status_code=200,
                 mimetype="application/json"
             )
         except FileNotFoundError as e:
-            logging.error(f"Stockfish setup error: {e}")
+            _log.error("Stockfish setup error: %s", e)
             return func.HttpResponse(
-                json.dumps({"error": str(e)}),
+                _dumps({"error": str(e)}),
                 status_code=500,
                 mimetype="application/json"
             )
         except PermissionError as e:
-            logging.error(f"Stockfish permission error: {e}")
+            _log.error("Stockfish permission error: %s", e)
             return func.HttpResponse(
-                json.dumps({"error": str(e)}),
+                _dumps({"error": str(e)}),
                 status_code=500,
                 mimetype="application/json"
             )
         except Exception as e:
-            logging.exception(f"An error occurred during analysis for FEN: {fen}")
+            _log.error("An error occurred during analysis for FEN: %s", fen, exc_info=True)
             return func.HttpResponse(
-                json.dumps({"error": f"An internal error occurred: {str(e)}"}),
+                _dumps({"error": f"An internal error occurred: {str(e)}"}),
                 status_code=500,
                 mimetype="application/json"
             )